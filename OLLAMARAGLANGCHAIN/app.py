@@ -1,10 +1,21 @@
 import os
 import json
+import atexit
 import uuid
+import shutil
+import hashlib
+import zipfile
+import argparse
 import datetime
+import threading
 from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash
+from collections import OrderedDict
+
+from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, session
 
 from werkzeug.utils import secure_filename
 
@@ -12,10 +23,27 @@ from langchain_chroma import Chroma
 #from langchain_community.vectorstores import Chroma
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
 
 from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.llms import Ollama
 
+# Verrous de fichier inter-process (fcntl sous Unix, msvcrt sous Windows)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# OCR (optionnel): pages scannées sans texte extractible
+try:
+    import pytesseract
+    from pdf2image import convert_from_path
+    OCR_AVAILABLE = True
+except ImportError:
+    OCR_AVAILABLE = False
+    print("OCR non disponible (pages scannées ignorées). Installation: pip install pytesseract pdf2image + tesseract-ocr poppler-utils")
+
 # -----------------------------
 # Config
 # -----------------------------
@@ -24,11 +52,16 @@ DATA_DIR = APP_ROOT / "data"
 UPLOAD_DIR = DATA_DIR / "uploads"
 CHROMA_DIR = DATA_DIR / "chroma"
 INDEX_PATH = DATA_DIR / "docs_index.json"
+OCR_CACHE_DIR = DATA_DIR / "ocr_cache"
+JOURNAL_DIR = DATA_DIR / "ingest_journal"
 
 DATA_DIR.mkdir(exist_ok=True)
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 CHROMA_DIR.mkdir(parents=True, exist_ok=True)
+OCR_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+JOURNAL_DIR.mkdir(parents=True, exist_ok=True)
 
+# complété par le registre LOADERS (voir plus bas)
 ALLOWED_EXTENSIONS = {"pdf"}
 
 # Choisis ton modèle Ollama
@@ -42,6 +75,26 @@ CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
 # Retrieval
 TOP_K = int(os.getenv("TOP_K", "6"))
 
+# Mémoire de conversation (par session)
+MEMORY_MAX_TOKENS = int(os.getenv("MEMORY_MAX_TOKENS", "800"))   # tours récents gardés tels quels
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))  # résumé glissant
+CHAT_SESSIONS_MAX = int(os.getenv("CHAT_SESSIONS_MAX", "1000"))
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "2048"))
+
+# OCR
+OCR_LANG = os.getenv("OCR_LANG", "fra+eng")
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 2)))
+# Une page avec moins de caractères que ça est considérée comme une image
+OCR_MIN_CHARS = int(os.getenv("OCR_MIN_CHARS", "20"))
+
+# Routing par résumé de document (recherche en 2 étapes)
+SUMMARY_COLLECTION = "rag_summaries"
+SUMMARY_INPUT_CHARS = int(os.getenv("SUMMARY_INPUT_CHARS", "6000"))
+ROUTING_TOP_DOCS = int(os.getenv("ROUTING_TOP_DOCS", "4"))
+# En dessous de ce nombre de docs, on cherche directement dans tous les chunks
+ROUTING_MIN_DOCS = int(os.getenv("ROUTING_MIN_DOCS", "8"))
+
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev-secret-key")
 
@@ -54,8 +107,14 @@ def load_index():
         return json.loads(INDEX_PATH.read_text(encoding="utf-8"))
     return {"docs": {}}
 
+def write_json_atomic(path: Path, data):
+    # écriture atomique: un crash ne laisse jamais un fichier à moitié écrit
+    tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
 def save_index(index):
-    INDEX_PATH.write_text(json.dumps(index, indent=2, ensure_ascii=False), encoding="utf-8")
+    write_json_atomic(INDEX_PATH, index)
 
 def allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -78,67 +137,693 @@ def get_vectorstore():
         embedding_function=get_embeddings(),
     )
 
+def get_summary_store():
+    # Petite collection séparée: 1 entrée (résumé) par document
+    return Chroma(
+        collection_name=SUMMARY_COLLECTION,
+        persist_directory=str(CHROMA_DIR),
+        embedding_function=get_embeddings(),
+    )
+
 def get_llm():
     return Ollama(model=OLLAMA_LLM_MODEL, temperature=0.2)
 
 
 # -----------------------------
-# Ingestion PDF -> Chroma
+# Résumés par document (routing)
 # -----------------------------
-def ingest_pdf(pdf_path: Path, original_filename: str):
-    loader = PyPDFLoader(str(pdf_path))
-    pages = loader.load()  # liste de Documents, metadata inclut 'page'
+SUMMARY_PROMPT = """Résume le document suivant en 5 à 8 phrases.
+Cite les sujets principaux, les entités nommées et le type de document.
+Réponds en français, sans introduction.
+
+DOCUMENT ({filename}):
+{text}
+
+RÉSUMÉ:"""
+
+def summarize_document(pages, original_filename: str) -> str:
+    # On ne donne au LLM que le début du document: suffisant pour router,
+    # et le coût reste borné quelle que soit la taille du PDF
+    text = ""
+    for p in pages:
+        if len(text) >= SUMMARY_INPUT_CHARS:
+            break
+        text += (p.page_content or "") + "\n"
+    text = text[:SUMMARY_INPUT_CHARS].strip()
+    if not text:
+        return original_filename
+
+    try:
+        summary = get_llm().invoke(SUMMARY_PROMPT.format(filename=original_filename, text=text))
+        summary = (summary or "").strip()
+    except Exception as e:
+        print(f"Résumé impossible pour {original_filename}: {e}")
+        summary = ""
+    # Fallback: début du texte brut, mieux que rien pour le routing
+    return summary or text[:1000]
+
+def add_document_summary(doc_id: str, original_filename: str, summary: str):
+    ss = get_summary_store()
+    ss.add_documents(
+        [Document(
+            page_content=f"{original_filename}\n{summary}",
+            metadata={"doc_id": doc_id, "source_filename": original_filename},
+        )],
+        ids=[doc_id],
+    )
+
+def route_documents(question: str, k: int = ROUTING_TOP_DOCS, query_embedding=None):
+    """
+    Étape 1: choisit les documents candidats via leurs résumés.
+    Retourne None si le routing n'est pas utile (peu de docs) ou impossible.
+    """
+    ss = get_summary_store()
+    try:
+        n_docs = ss._collection.count()
+    except Exception:
+        return None
+    if n_docs < ROUTING_MIN_DOCS:
+        return None
+    # Docs ingérés avant les résumés: pas de routing tant qu'ils ne sont pas couverts
+    if n_docs < len(load_index()["docs"]):
+        return None
+
+    if query_embedding is not None:
+        results = ss.similarity_search_by_vector(query_embedding, k=min(k, n_docs))
+    else:
+        results = ss.similarity_search(question, k=min(k, n_docs))
+    doc_ids = [d.metadata.get("doc_id") for d in results if d.metadata.get("doc_id")]
+    return doc_ids or None
+
+
+# -----------------------------
+# OCR des pages image (worker pool)
+# -----------------------------
+def ocr_page(pdf_path: str, page_index: int):
+    # Exécuté dans un process worker: rendu + OCR sont CPU-bound
+    images = convert_from_path(pdf_path, dpi=OCR_DPI, first_page=page_index + 1, last_page=page_index + 1)
+    if not images:
+        return page_index, "", False
+    img = images[0]
+
+    # Cache par hash de l'image de la page: un ré-ingest ne refait jamais l'OCR
+    h = hashlib.sha256(f"{img.mode}{img.size}{OCR_LANG}".encode() + img.tobytes()).hexdigest()
+    cache_path = OCR_CACHE_DIR / f"{h}.txt"
+    if cache_path.exists():
+        return page_index, cache_path.read_text(encoding="utf-8"), True
+
+    text = pytesseract.image_to_string(img, lang=OCR_LANG)
+    tmp = cache_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, cache_path)
+    return page_index, text, False
+
+# Un seul pool OCR pour le process, créé au premier besoin: les imports en
+# masse (IMPORT_WORKERS threads) le partagent au lieu d'en démarrer un par fichier
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+
+def get_ocr_pool():
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            _ocr_pool = ProcessPoolExecutor(max_workers=max(1, OCR_WORKERS))
+        return _ocr_pool
+
+def reset_ocr_pool(pool):
+    """Écarte un pool cassé (worker mort): le suivant sera recréé"""
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is pool:
+            _ocr_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+@atexit.register
+def shutdown_ocr_pool():
+    with _ocr_pool_lock:
+        pool = _ocr_pool
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def ocr_empty_pages(pdf_path: Path, pages):
+    """
+    Repère les pages sans texte extractible (scans) et les passe à l'OCR
+    en parallèle. Les Documents sont modifiés sur place.
+    Retourne le nombre de pages OCRisées.
+    """
+    empty = [i for i, p in enumerate(pages) if len((p.page_content or "").strip()) < OCR_MIN_CHARS]
+    if not empty:
+        return 0
+    if not OCR_AVAILABLE:
+        print(f"{len(empty)} page(s) sans texte ignorée(s) dans {pdf_path.name} (OCR non disponible)")
+        return 0
+
+    done = 0
+    cached = 0
+    pool = get_ocr_pool()
+    futures = [pool.submit(ocr_page, str(pdf_path), i) for i in empty]
+    for fut in as_completed(futures):
+        try:
+            i, text, from_cache = fut.result()
+        except BrokenProcessPool as e:
+            reset_ocr_pool(pool)
+            print(f"Erreur OCR ({pdf_path.name}): {e}")
+            continue
+        except Exception as e:
+            print(f"Erreur OCR ({pdf_path.name}): {e}")
+            continue
+        if not text.strip():
+            continue
+        pages[i].page_content = text
+        pages[i].metadata = dict(pages[i].metadata or {}, ocr=True)
+        done += 1
+        cached += int(from_cache)
+
+    print(f"OCR: {done}/{len(empty)} page(s) dans {pdf_path.name} ({cached} depuis le cache)")
+    return done
+
+
+# -----------------------------
+# Loaders (registre par extension)
+# -----------------------------
+# Taille des blocs lus en streaming pour les gros fichiers texte
+TEXT_BLOCK_CHARS = int(os.getenv("TEXT_BLOCK_CHARS", "200000"))
+
+def load_pdf(path: Path):
+    pages = PyPDFLoader(str(path)).load()  # liste de Documents, metadata inclut 'page'
+    ocr_empty_pages(path, pages)
+    return pages
+
+def load_text_stream(path: Path):
+    # Lecture par blocs (coupés en fin de ligne): un fichier de plusieurs Go
+    # ne passe jamais entièrement en mémoire
+    buf = ""
+    block = 0
+    with open(path, encoding="utf-8", errors="replace") as fh:
+        for line in fh:
+            buf += line
+            if len(buf) >= TEXT_BLOCK_CHARS:
+                yield Document(page_content=buf, metadata={"block": block})
+                block += 1
+                buf = ""
+    if buf.strip():
+        yield Document(page_content=buf, metadata={"block": block})
+
+def load_html(path: Path):
+    from langchain_community.document_loaders import BSHTMLLoader
+    return BSHTMLLoader(str(path), open_encoding="utf-8").lazy_load()
+
+def load_docx(path: Path):
+    from langchain_community.document_loaders import Docx2txtLoader
+    return Docx2txtLoader(str(path)).lazy_load()
+
+def load_csv(path: Path):
+    # 1 Document par ligne, lu en streaming
+    from langchain_community.document_loaders import CSVLoader
+    return CSVLoader(str(path), encoding="utf-8").lazy_load()
+
+# extension -> (fonction de chargement, mime)
+LOADERS = {
+    "pdf": (load_pdf, "application/pdf"),
+    "txt": (load_text_stream, "text/plain"),
+    "md": (load_text_stream, "text/markdown"),
+    "markdown": (load_text_stream, "text/markdown"),
+    "html": (load_html, "text/html"),
+    "htm": (load_html, "text/html"),
+    "docx": (load_docx, "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    "csv": (load_csv, "text/csv"),
+}
+
+def register_loader(ext: str, load_fn, mime: str):
+    LOADERS[ext.lower()] = (load_fn, mime)
+    ALLOWED_EXTENSIONS.add(ext.lower())
+
+ALLOWED_EXTENSIONS.update(LOADERS)
+
+def file_ext(filename: str) -> str:
+    return filename.rsplit(".", 1)[1].lower() if "." in filename else ""
+
+
+# -----------------------------
+# Ingestion fichier -> Chroma
+# -----------------------------
+# Nb de chunks envoyés à Chroma (et donc aux embeddings) par appel
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+
+# docs_index.json est partagé entre les workers d'import
+INDEX_LOCK = threading.Lock()
+
+# -----------------------------
+# Journal d'ingestion (reprise après crash)
+# -----------------------------
+# Un fichier par ingestion en cours: data/ingest_journal/<doc_id>.json
+# Il est mis à jour après chaque lot commité dans Chroma et supprimé une fois
+# le document enregistré dans docs_index.json.
+# Pendant l'ingestion, <doc_id>.lock est verrouillé: la reprise ne touche pas
+# à un journal qu'un autre thread/process est en train d'écrire. Le verrou
+# est libéré par l'OS si le process meurt (cas d'un vrai crash).
+def journal_path(doc_id: str) -> Path:
+    return JOURNAL_DIR / f"{doc_id}.json"
+
+@contextmanager
+def journal_lock(doc_id: str, blocking: bool = True):
+    """Verrou exclusif sur l'ingestion de doc_id. Produit False s'il est déjà pris (blocking=False)."""
+    lock_path = JOURNAL_DIR / f"{doc_id}.lock"
+    fh = open(lock_path, "a+")
+    try:
+        try:
+            if fcntl:
+                fcntl.flock(fh, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            # ingestion terminée: plus rien à protéger (un concurrent qui
+            # obtiendrait ce verrou ne trouvera plus de journal)
+            if not journal_path(doc_id).exists():
+                lock_path.unlink(missing_ok=True)
+    finally:
+        fh.close()
+
+def chunk_ids(doc_id: str, chunks):
+    # ids déterministes: rejouer un lot après un crash écrase au lieu de dupliquer
+    return [f"{doc_id}:{d.metadata['chunk_id']}" for d in chunks]
+
+def delete_document_vectors(doc_id: str):
+    get_vectorstore()._collection.delete(where={"doc_id": doc_id})
+    get_summary_store()._collection.delete(ids=[doc_id])
+
+def remove_document(doc_id: str):
+    """Retire un document: chunks, entrée de routing (résumé), index json et copie stockée"""
+    delete_document_vectors(doc_id)
+    with INDEX_LOCK:
+        index = load_index()
+        entry = index["docs"].pop(doc_id, None)
+        if entry is not None:
+            save_index(index)
+    if entry and entry.get("stored_path"):
+        Path(entry["stored_path"]).unlink(missing_ok=True)
+
+def recover_ingestions():
+    """
+    Au démarrage: reprend les ingestions interrompues à partir du dernier lot
+    commité. Si le fichier source a disparu, supprime les chunks orphelins.
+    Retourne la liste des (journal, info) reprises avec succès.
+    """
+    recovered = []
+    for jp in sorted(JOURNAL_DIR.glob("*.json")):
+        doc_id = jp.stem
+        with journal_lock(doc_id, blocking=False) as locked:
+            if not locked:
+                # ingestion en cours (upload, import): pas une ingestion interrompue
+                continue
+            # relu sous le verrou: il a pu être terminé entre-temps
+            if not jp.exists():
+                continue
+            journal = json.loads(jp.read_text(encoding="utf-8"))
+
+            # crash entre l'écriture de l'index et la suppression du journal
+            if doc_id in load_index()["docs"]:
+                jp.unlink(missing_ok=True)
+                continue
+
+            path = Path(journal["stored_path"])
+            if not path.exists():
+                print(f"Ingestion orpheline {journal['filename']} ({doc_id}): fichier absent, nettoyage")
+                delete_document_vectors(doc_id)
+                jp.unlink(missing_ok=True)
+                continue
+
+            print(f"Reprise de {journal['filename']} ({doc_id}) après {journal['committed_chunks']} chunks")
+            try:
+                info = _ingest_file(
+                    path, journal["filename"], doc_id,
+                    resume_from=journal["committed_chunks"],
+                    origin=journal.get("origin"),
+                )
+            except Exception as e:
+                # on garde le journal: nouvelle tentative au prochain démarrage
+                print(f"Échec de la reprise de {journal['filename']}: {e}")
+                continue
+        recovered.append((journal, info))
+    return recovered
+
+def cleanup_orphans(page_size: int = 5000):
+    """
+    Parcourt toute la collection et supprime les chunks dont le doc_id n'est
+    ni dans docs_index.json ni dans un journal en cours (ex: crash avant
+    l'existence du journal). Coûteux sur une grosse base: lancé à la demande.
+    """
+    known = set(load_index()["docs"]) | {p.stem for p in JOURNAL_DIR.glob("*.json")}
+    col = get_vectorstore()._collection
+    orphans = set()
+    offset = 0
+    while True:
+        res = col.get(include=["metadatas"], limit=page_size, offset=offset)
+        metadatas = res.get("metadatas") or []
+        for md in metadatas:
+            doc_id = (md or {}).get("doc_id")
+            if doc_id and doc_id not in known:
+                orphans.add(doc_id)
+        if len(metadatas) < page_size:
+            break
+        offset += page_size
+
+    for doc_id in orphans:
+        delete_document_vectors(doc_id)
+    print(f"Nettoyage: {len(orphans)} document(s) orphelin(s) supprimé(s)")
+    return sorted(orphans)
+
+def ingest_file(path: Path, original_filename: str, doc_id: str = None, resume_from: int = 0, origin: dict = None):
+    """
+    resume_from: nb de chunks déjà commités (reprise depuis le journal),
+    ils sont re-découpés mais pas ré-embeddés.
+    """
+    doc_id = doc_id or str(uuid.uuid4())
+    with journal_lock(doc_id):
+        return _ingest_file(path, original_filename, doc_id, resume_from, origin)
+
+def _ingest_file(path: Path, original_filename: str, doc_id: str, resume_from: int = 0, origin: dict = None):
+    # appelé avec journal_lock(doc_id) tenu
+    ext = file_ext(original_filename)
+    if ext not in LOADERS:
+        raise ValueError(f"Extension non supportée: {ext or original_filename}")
+    load_fn, mime = LOADERS[ext]
+
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=CHUNK_SIZE,
         chunk_overlap=CHUNK_OVERLAP,
         separators=["\n\n", "\n", " ", ""],
     )
-    chunks = splitter.split_documents(pages)
-
-    doc_id = str(uuid.uuid4())
-    file_stat = pdf_path.stat()
-
-    # enrich metadata
-    enriched = []
-    for i, d in enumerate(chunks):
-        md = dict(d.metadata or {})
-        md.update({
-            "doc_id": doc_id,
-            "chunk_id": i,
-            "source_filename": original_filename,
-            "source_stored_path": str(pdf_path),
-            "mime": "application/pdf",
-            "size_bytes": file_stat.st_size,
-            "ingested_at": now_iso(),
-        })
-        d.metadata = md
-        enriched.append(d)
 
+    file_stat = path.stat()
     vs = get_vectorstore()
-    vs.add_documents(enriched)
-    vs.persist()
 
-    # index json (facultatif mais utile)
-    index = load_index()
-    index["docs"][doc_id] = {
+    journal = {
         "doc_id": doc_id,
         "filename": original_filename,
-        "stored_path": str(pdf_path),
-        "ingested_at": now_iso(),
+        "stored_path": str(path),
         "size_bytes": file_stat.st_size,
-        "chunks": len(enriched),
-        "pages": len(pages),
+        "started_at": now_iso(),
+        "committed_chunks": resume_from,
+        "origin": origin,
     }
-    save_index(index)
+    write_json_atomic(journal_path(doc_id), journal)
+
+    def commit(batch):
+        vs.add_documents(batch, ids=chunk_ids(doc_id, batch))
+        journal["committed_chunks"] = batch[-1].metadata["chunk_id"] + 1
+        write_json_atomic(journal_path(doc_id), journal)
+
+    n_pages = 0
+    n_chunks = 0
+    ocr_pages = 0
+    head_pages = []  # début du document, pour le résumé
+    head_chars = 0
+    batch = []
+
+    # Chaque "page" (page PDF, bloc texte, ligne CSV...) est découpée puis
+    # envoyée par lots: la mémoire reste bornée même pour un très gros fichier
+    for page in load_fn(path):
+        n_pages += 1
+        if (page.metadata or {}).get("ocr"):
+            ocr_pages += 1
+        if head_chars < SUMMARY_INPUT_CHARS:
+            head_pages.append(page)
+            head_chars += len(page.page_content or "")
+
+        for d in splitter.split_documents([page]):
+            # enrich metadata
+            md = dict(d.metadata or {})
+            md.update({
+                "doc_id": doc_id,
+                "chunk_id": n_chunks,
+                "source_filename": original_filename,
+                "source_stored_path": str(path),
+                "mime": mime,
+                "size_bytes": file_stat.st_size,
+                "ingested_at": now_iso(),
+            })
+            d.metadata = md
+            n_chunks += 1
+            if md["chunk_id"] < resume_from:
+                continue  # déjà dans Chroma
+            batch.append(d)
+
+            if len(batch) >= INGEST_BATCH_SIZE:
+                commit(batch)
+                batch = []
+
+    if batch:
+        commit(batch)
+    vs.persist()
+
+    # résumé + embedding du résumé, pour le routing à la requête
+    summary = summarize_document(head_pages, original_filename)
+    add_document_summary(doc_id, original_filename, summary)
+
+    # index json (facultatif mais utile)
+    with INDEX_LOCK:
+        index = load_index()
+        index["docs"][doc_id] = {
+            "doc_id": doc_id,
+            "filename": original_filename,
+            "stored_path": str(path),
+            "mime": mime,
+            "ingested_at": now_iso(),
+            "size_bytes": file_stat.st_size,
+            "chunks": n_chunks,
+            "pages": n_pages,
+            "ocr_pages": ocr_pages,
+            "summary": summary,
+        }
+        save_index(index)
+    journal_path(doc_id).unlink(missing_ok=True)
 
     return {
         "doc_id": doc_id,
         "filename": original_filename,
-        "pages": len(pages),
-        "chunks": len(enriched),
+        "pages": n_pages,
+        "chunks": n_chunks,
         "size_bytes": file_stat.st_size,
     }
 
+def ingest_pdf(pdf_path: Path, original_filename: str):
+    return ingest_file(pdf_path, original_filename)
+
+
+# -----------------------------
+# Import en masse (dossier / zip)
+# -----------------------------
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "4"))
+
+def _checkpoint_path(source: Path) -> Path:
+    key = hashlib.sha1(str(source.resolve()).encode()).hexdigest()[:12]
+    return DATA_DIR / f"import_checkpoint_{key}.json"
+
+def bulk_import(source: Path, workers: int = IMPORT_WORKERS):
+    """
+    Ingère tous les fichiers supportés d'un dossier (récursif) ou d'une archive zip.
+    Reprenable: les fichiers déjà ingérés (checkpoint) sont sautés.
+    """
+    source = Path(source)
+    source_key = str(source.resolve())
+    ckpt_path = _checkpoint_path(source)
+    done = json.loads(ckpt_path.read_text(encoding="utf-8")) if ckpt_path.exists() else {}
+    ckpt_lock = threading.Lock()
+
+    # fichiers interrompus en cours d'ingestion: on les termine d'abord
+    for journal, info in recover_ingestions():
+        origin = journal.get("origin") or {}
+        if origin.get("source") == source_key:
+            done[origin["name"]] = {
+                "doc_id": info["doc_id"], "size_bytes": origin["size_bytes"],
+                "fingerprint": origin.get("fingerprint"), "chunks": info["chunks"],
+            }
+    write_json_atomic(ckpt_path, done)
+
+    # empreinte = taille + mtime (dossier) ou taille + CRC32 (zip, stocké dans l'archive)
+    zf = None
+    zip_lock = threading.Lock()  # ZipFile n'est pas thread-safe
+    if source.is_file() and zipfile.is_zipfile(source):
+        zf = zipfile.ZipFile(source)
+        entries = [(i.filename, i.file_size, f"{i.file_size}:{i.CRC:08x}") for i in zf.infolist() if not i.is_dir()]
+    else:
+        entries = []
+        for p in source.rglob("*"):
+            if p.is_file():
+                st = p.stat()
+                entries.append((str(p.relative_to(source)), st.st_size, f"{st.st_size}:{st.st_mtime_ns}"))
+
+    # checkpoints antérieurs aux empreintes: taille identique = inchangé
+    for name, size, fingerprint in entries:
+        entry = done.get(name)
+        if entry and not entry.get("fingerprint") and entry.get("size_bytes") == size:
+            entry["fingerprint"] = fingerprint
+
+    # clé = chemin relatif + empreinte: un fichier modifié est ré-ingéré
+    todo = [
+        (name, size, fingerprint) for (name, size, fingerprint) in entries
+        if allowed_file(name) and done.get(name, {}).get("fingerprint") != fingerprint
+    ]
+    print(f"Import {source}: {len(todo)} fichier(s) à ingérer, {len(entries) - len(todo)} ignoré(s)/déjà faits")
+
+    def work(name, size, fingerprint):
+        # ancienne version du fichier: retirée avant d'ingérer la nouvelle,
+        # sinon la recherche renverrait les deux
+        previous = done.get(name, {}).get("doc_id")
+        if previous:
+            remove_document(previous)
+        filename = secure_filename(Path(name).name)
+        dest = UPLOAD_DIR / f"{uuid.uuid4()}__{filename}"
+        if zf is not None:
+            with zip_lock, zf.open(name) as src, open(dest, "wb") as out:
+                shutil.copyfileobj(src, out)
+        else:
+            shutil.copyfile(source / name, dest)
+        origin = {"source": source_key, "name": name, "size_bytes": size, "fingerprint": fingerprint}
+        return ingest_file(dest, filename, origin=origin)
+
+    ok = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(work, *item): item for item in todo}
+        for fut in as_completed(futures):
+            name, size, fingerprint = futures[fut]
+            try:
+                info = fut.result()
+            except Exception as e:
+                failed += 1
+                print(f"Échec {name}: {e}")
+                continue
+            ok += 1
+            with ckpt_lock:
+                done[name] = {"doc_id": info["doc_id"], "size_bytes": size, "fingerprint": fingerprint, "chunks": info["chunks"]}
+                write_json_atomic(ckpt_path, done)
+            print(f"[{ok + failed}/{len(todo)}] {name}: {info['chunks']} chunks")
+
+    if zf is not None:
+        zf.close()
+    print(f"Import terminé: {ok} ingéré(s), {failed} échec(s). Checkpoint: {ckpt_path}")
+    return {"ingested": ok, "failed": failed, "checkpoint": str(ckpt_path)}
+
+
+# -----------------------------
+# Mémoire de conversation
+# -----------------------------
+# chat_id -> {"summary": str, "turns": [(question, answer)]}
+# Bornée en nombre de sessions (LRU) et en tokens par session: le prompt ne
+# grossit pas avec la longueur de la conversation.
+CHAT_MEMORY = OrderedDict()
+CHAT_MEMORY_LOCK = threading.Lock()
+
+# texte de requête normalisé -> embedding (LRU)
+QUERY_EMBED_CACHE = OrderedDict()
+QUERY_EMBED_LOCK = threading.Lock()
+
+def estimate_tokens(text: str) -> int:
+    # approximation suffisante pour borner la mémoire (~4 caractères / token)
+    return len(text or "") // 4 + 1
+
+def get_chat_memory(chat_id: str):
+    with CHAT_MEMORY_LOCK:
+        mem = CHAT_MEMORY.get(chat_id)
+        if mem is None:
+            mem = {"summary": "", "turns": []}
+            CHAT_MEMORY[chat_id] = mem
+            while len(CHAT_MEMORY) > CHAT_SESSIONS_MAX:
+                CHAT_MEMORY.popitem(last=False)
+        CHAT_MEMORY.move_to_end(chat_id)
+        return mem
+
+def reset_chat_memory(chat_id: str):
+    with CHAT_MEMORY_LOCK:
+        CHAT_MEMORY.pop(chat_id, None)
+
+def format_history(mem) -> str:
+    parts = []
+    if mem["summary"]:
+        parts.append(f"RÉSUMÉ DE LA CONVERSATION:\n{mem['summary']}")
+    for q, a in mem["turns"]:
+        parts.append(f"Utilisateur: {q}\nAssistant: {a}")
+    return "\n\n".join(parts)
+
+CONDENSE_PROMPT = """À partir de l'historique de conversation et de la nouvelle question,
+reformule la question pour qu'elle soit compréhensible seule (sans l'historique).
+Ne réponds pas à la question. Renvoie uniquement la question reformulée.
+
+HISTORIQUE:
+{history}
+
+NOUVELLE QUESTION: {question}
+
+QUESTION AUTONOME:"""
+
+def condense_question(question: str, mem) -> str:
+    # 1er tour: rien à condenser, pas d'appel LLM
+    if not mem["summary"] and not mem["turns"]:
+        return question
+    try:
+        standalone = get_llm().invoke(CONDENSE_PROMPT.format(history=format_history(mem), question=question))
+        standalone = (standalone or "").strip()
+    except Exception as e:
+        print(f"Reformulation impossible: {e}")
+        standalone = ""
+    return standalone or question
+
+MEMORY_SUMMARY_PROMPT = """Mets à jour le résumé de la conversation avec les nouveaux échanges.
+Garde les faits, documents et sujets utiles pour la suite. {max_words} mots maximum.
+Réponds en français.
+
+RÉSUMÉ ACTUEL:
+{summary}
+
+NOUVEAUX ÉCHANGES:
+{turns}
+
+NOUVEAU RÉSUMÉ:"""
+
+def remember_turn(mem, question: str, answer: str):
+    mem["turns"].append((question, answer))
+
+    # Les tours les plus anciens qui dépassent le budget sont fondus dans le
+    # résumé (mise à jour incrémentale, pas de ré-résumé du transcript complet)
+    overflow = []
+    while len(mem["turns"]) > 1 and sum(estimate_tokens(q) + estimate_tokens(a) for q, a in mem["turns"]) > MEMORY_MAX_TOKENS:
+        overflow.append(mem["turns"].pop(0))
+    if not overflow:
+        return
+
+    turns = "\n\n".join(f"Utilisateur: {q}\nAssistant: {a}" for q, a in overflow)
+    try:
+        summary = get_llm().invoke(MEMORY_SUMMARY_PROMPT.format(
+            summary=mem["summary"] or "(vide)",
+            turns=turns,
+            max_words=SUMMARY_MAX_TOKENS * 3 // 4,
+        ))
+    except Exception as e:
+        print(f"Résumé de conversation impossible: {e}")
+        summary = f"{mem['summary']}\n{turns}"
+    # garde-fou: le résumé reste borné même si le LLM est trop bavard
+    mem["summary"] = (summary or "").strip()[-SUMMARY_MAX_TOKENS * 4:]
+
+def embed_query_cached(text: str):
+    key = " ".join(text.lower().split())
+    with QUERY_EMBED_LOCK:
+        if key in QUERY_EMBED_CACHE:
+            QUERY_EMBED_CACHE.move_to_end(key)
+            return QUERY_EMBED_CACHE[key]
+    emb = get_embeddings().embed_query(text)
+    with QUERY_EMBED_LOCK:
+        QUERY_EMBED_CACHE[key] = emb
+        while len(QUERY_EMBED_CACHE) > QUERY_EMBED_CACHE_SIZE:
+            QUERY_EMBED_CACHE.popitem(last=False)
+    return emb
+
 
 # -----------------------------
 # RAG Chat
@@ -150,7 +835,7 @@ Toujours citer les sources sous forme: [filename p.X] pour chaque information im
 Réponds en français.
 """
 
-def build_prompt(question: str, retrieved_docs):
+def build_prompt(question: str, retrieved_docs, history: str = ""):
     # On met beaucoup d’infos pour faciliter les citations
     context_parts = []
     for d in retrieved_docs:
@@ -160,8 +845,9 @@ def build_prompt(question: str, retrieved_docs):
         context_parts.append(f"SOURCE: {fn} {page_str}\n{d.page_content}")
 
     context = "\n\n---\n\n".join(context_parts)
+    history_block = f"\nHISTORIQUE (pour comprendre la question, pas comme source):\n{history}\n" if history else ""
     return f"""{RAG_SYSTEM}
-
+{history_block}
 CONTEXTE:
 {context}
 
@@ -172,17 +858,34 @@ RÉPONSE (avec citations):"""
 
 def retrieve(question: str):
     vs = get_vectorstore()
-    # retourne (Document, score) ; score plus proche de 1 => meilleur (selon la méthode)
-    results = vs.similarity_search_with_relevance_scores(question, k=TOP_K)
+    # Un seul embedding (mis en cache) pour les 2 étapes
+    query_embedding = embed_query_cached(question)
+    # Étape 1: restreindre aux documents les plus pertinents (si beaucoup de docs)
+    doc_ids = route_documents(question, query_embedding=query_embedding)
+    search_kwargs = {}
+    if doc_ids:
+        search_kwargs["filter"] = {"doc_id": {"$in": doc_ids}}
+    # Étape 2: recherche des chunks (uniquement dans les docs candidats)
+    # retourne (Document, distance) -> converti en score de pertinence, plus proche de 1 => meilleur
+    relevance = vs._select_relevance_score_fn()
+    results = [
+        (d, relevance(dist))
+        for (d, dist) in vs.similarity_search_by_vector_with_relevance_scores(query_embedding, k=TOP_K, **search_kwargs)
+    ]
     docs = [d for (d, s) in results]
     scores = [s for (d, s) in results]
     return results, docs, scores
 
-def chat_rag(question: str):
-    results, docs, scores = retrieve(question)
+def chat_rag(question: str, chat_id: str = None):
+    mem = get_chat_memory(chat_id) if chat_id else None
+    # Question reformulée (autonome) pour la recherche; la question d'origine reste dans le prompt
+    search_query = condense_question(question, mem) if mem else question
+    results, docs, scores = retrieve(search_query)
     llm = get_llm()
-    prompt = build_prompt(question, docs)
+    prompt = build_prompt(question, docs, history=format_history(mem) if mem else "")
     answer = llm.invoke(prompt)
+    if mem is not None:
+        remember_turn(mem, question, answer)
 
     # Préparer des "sources" riches pour l’UI
     sources = []
@@ -204,6 +907,26 @@ def chat_rag(question: str):
 # -----------------------------
 # Routes
 # -----------------------------
+_recovery_started = False
+_recovery_lock = threading.Lock()
+
+def start_recovery():
+    """Lance (une fois par process) la reprise des ingestions interrompues en arrière-plan"""
+    global _recovery_started
+    with _recovery_lock:
+        if _recovery_started:
+            return
+        _recovery_started = True
+    threading.Thread(target=recover_ingestions, daemon=True).start()
+
+@app.before_request
+def ensure_recovery():
+    # dans le process qui sert les requêtes, quel que soit le serveur
+    # (gunicorn, app.run avec ou sans reloader); sans risque en parallèle
+    # grâce aux verrous de journal
+    if not _recovery_started:
+        start_recovery()
+
 @app.get("/")
 def home():
     return render_template("index.html")
@@ -215,9 +938,21 @@ def chat():
     if not question:
         return jsonify({"error": "Message vide"}), 400
 
-    answer, sources = chat_rag(question)
+    if "chat_id" not in session:
+        session["chat_id"] = str(uuid.uuid4())
+    answer, sources = chat_rag(question, chat_id=session["chat_id"])
     return jsonify({"answer": answer, "sources": sources})
 
+@app.post("/chat/reset")
+def chat_reset():
+    """
+    Nouvelle conversation: oublie l'historique de la session
+    """
+    chat_id = session.pop("chat_id", None)
+    if chat_id:
+        reset_chat_memory(chat_id)
+    return jsonify({"ok": True})
+
 @app.post("/upload")
 def upload():
     if "file" not in request.files:
@@ -230,16 +965,16 @@ def upload():
         return redirect(url_for("home"))
 
     if not allowed_file(f.filename):
-        flash("Extension non supportée (PDF uniquement)", "error")
+        flash(f"Extension non supportée ({', '.join(sorted(ALLOWED_EXTENSIONS))})", "error")
         return redirect(url_for("home"))
 
     filename = secure_filename(f.filename)
-    # On stocke physiquement le PDF (tu peux choisir de ne pas garder le fichier)
+    # On stocke physiquement le fichier (tu peux choisir de ne pas garder le fichier)
     dest = UPLOAD_DIR / f"{uuid.uuid4()}__{filename}"
     f.save(dest)
 
-    info = ingest_pdf(dest, filename)
-    flash(f"PDF ingéré: {info['filename']} ({info['pages']} pages, {info['chunks']} chunks)", "success")
+    info = ingest_file(dest, filename)
+    flash(f"Fichier ingéré: {info['filename']} ({info['pages']} pages, {info['chunks']} chunks)", "success")
     return redirect(url_for("home"))
 
 @app.get("/docs")
@@ -308,5 +1043,25 @@ def doc_detail(doc_id):
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", "5000")), debug=True)
+    parser = argparse.ArgumentParser(description="Flask RAG (Ollama + LangChain + Chroma)")
+    sub = parser.add_subparsers(dest="command")
+    p_import = sub.add_parser("import", help="Import en masse d'un dossier ou d'un zip")
+    p_import.add_argument("source", type=Path)
+    p_import.add_argument("--workers", type=int, default=IMPORT_WORKERS)
+    p_recover = sub.add_parser("recover", help="Reprend les ingestions interrompues")
+    p_recover.add_argument("--scan-orphans", action="store_true", help="Parcourt aussi toute la base")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        bulk_import(args.source, workers=args.workers)
+    elif args.command == "recover":
+        recover_ingestions()
+        if args.scan_orphans:
+            cleanup_orphans()
+    else:
+        # Le reloader Flask relance le script: la reprise démarre dès le
+        # lancement dans le process qui sert les requêtes (sinon à la première)
+        if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            start_recovery()
+        app.run(host="0.0.0.0", port=int(os.getenv("PORT", "5000")), debug=True)
 
@@ -0,0 +1,31 @@
+"""
+Archivage manuel (ou par cron) de l'historique des conversations.
+
+Déplace les messages de plus de N jours dans archives/user_<id>/*.jsonl.gz,
+puis compacte la base (VACUUM). Peut tourner pendant que l'application est
+lancée: les écritures attendent la fin du VACUUM.
+
+Usage:
+python archive_history.py --days 90
+python archive_history.py --days 30 --no-vacuum
+"""
+
+import argparse
+
+from appchatbot import app, db, run_archival, ARCHIVE_AFTER_DAYS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS or 90,
+                        help='âge minimum des messages archivés (jours)')
+    parser.add_argument('--no-vacuum', action='store_true', help='ne pas compacter la base')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        run_archival(args.days, vacuum=not args.no_vacuum)
+
+
+if __name__ == '__main__':
+    main()
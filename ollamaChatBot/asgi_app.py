@@ -0,0 +1,410 @@
+"""
+Serveur asynchrone (ASGI) pour les routes de chat.
+
+Avec Flask (WSGI), chaque requête /api/chat occupe un thread pendant toute la
+génération Ollama. Ici, /api/chat et /api/chat/stream sont servies par des
+coroutines: une requête en attente dans la file équitable ou en cours de
+génération ne coûte qu'une tâche asyncio et une connexion du pool HTTP vers
+Ollama. Toutes les autres routes (authentification, upload, historique...)
+restent celles de l'application Flask, montée telle quelle.
+
+Les sessions Flask (cookie signé) sont relues ici; les accès SQLAlchemy, courts,
+sont faits dans un pool de threads avec le contexte de l'application.
+
+Installation:
+pip install starlette uvicorn httpx a2wsgi
+
+Lancement (un seul worker: la file de génération et les caches sont en mémoire):
+uvicorn asgi_app:app --host 0.0.0.0 --port 5005
+"""
+
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from appchatbot import (
+    app as flask_app, db, ChatMessage, LANGCHAIN_AVAILABLE,
+    OLLAMA_BASE_URL, OLLAMA_LLM_MODEL, OLLAMA_TEMPERATURE, STREAM_PERSIST_SECONDS,
+    SHED_MESSAGE, generation_scheduler, response_cache, lookup_response_cache,
+    prompt_parts, build_history, build_prompt, record_generation, user_labels,
+    metrics, schedule_summary_update, sse, start_background_tasks, resolve_file_scope,
+    MAX_MESSAGE_TOKENS, estimate_tokens, calibrate_tokens, long_message_prompts,
+    assemble_condensed, check_generation_allowed, record_token_usage,
+)
+
+# Pool de connexions HTTP vers Ollama (partagé par toutes les requêtes)
+OLLAMA_MAX_CONNECTIONS = int(os.getenv('OLLAMA_MAX_CONNECTIONS', '100'))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv('OLLAMA_CONNECT_TIMEOUT', '5'))
+
+http_client = None
+
+# Écritures de fin de requête encore en cours (voir persist)
+pending_writes = set()
+
+# ============= UTILITAIRES =============
+
+async def run_sync(fn, *args):
+    """Exécute du code SQLAlchemy (bloquant) dans un thread, avec le contexte Flask"""
+    def call():
+        with flask_app.app_context():
+            return fn(*args)
+    return await asyncio.to_thread(call)
+
+async def persist(fn, *args):
+    """Écriture de fin de requête (réponse, tokens), faite même si le client est parti.
+
+    Après une déconnexion, la tâche est annulée et chaque `await` du `finally`
+    peut l'être aussi: l'écriture tourne dans sa propre tâche, protégée par
+    asyncio.shield, et va jusqu'au bout. Le code qui suit l'appel n'est alors
+    pas exécuté: persist doit être la dernière étape du `finally`.
+    """
+    task = asyncio.ensure_future(run_sync(fn, *args))
+    pending_writes.add(task)
+    task.add_done_callback(pending_writes.discard)
+    await asyncio.shield(task)
+
+def session_user_id(request):
+    """user_id de la session Flask (cookie signé), ou None"""
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return None
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        data = serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except Exception:
+        return None
+    return data.get('user_id')
+
+def instrumented(route):
+    """Mêmes métriques HTTP que les routes Flask (voir record_request_metrics)"""
+    def decorator(handler):
+        async def wrapper(request):
+            start = time.perf_counter()
+            response = await handler(request)
+            labels = user_labels(session_user_id(request), method=request.method, route=route)
+            metrics.observe('chatbot_http_request_duration_seconds', time.perf_counter() - start, labels)
+            metrics.inc('chatbot_http_requests_total', dict(labels, status=str(response.status_code)))
+            return response
+        return wrapper
+    return decorator
+
+async def read_json(request):
+    try:
+        return await request.json() or {}
+    except ValueError:
+        return {}
+
+def watch_ticket(ticket):
+    """asyncio.Event déclenché quand le scheduler sert (ou abandonne) le ticket"""
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    ticket.on_ready = lambda: loop.call_soon_threadsafe(ready.set)
+    # le ticket a pu être servi avant l'enregistrement du callback
+    if ticket.event.is_set():
+        ready.set()
+    return ready
+
+async def wait_turn(ticket, ready):
+    """Attend le ticket; produit la position en file toutes les secondes"""
+    while not ticket.event.is_set():
+        try:
+            await asyncio.wait_for(ready.wait(), 1.0)
+        except asyncio.TimeoutError:
+            generation_scheduler.shed_expired()
+            if not ticket.event.is_set():
+                yield generation_scheduler.position(ticket) + 1
+
+# ============= GÉNÉRATION =============
+
+def chat_prompt_parts(message, user_id, exclude_message_id=None, file_ids=None):
+    # La recherche dans les PDFs passe par Chroma (optionnel ici): sans
+    # LangChain, seul l'historique est ajouté au prompt
+    if LANGCHAIN_AVAILABLE:
+        return prompt_parts(message, user_id, exclude_message_id, file_ids)
+    return '', build_history(user_id, exclude_message_id)
+
+def count_usage(usage, chunk, chars):
+    """Ajoute à usage les comptes de tokens du dernier morceau Ollama"""
+    usage['prompt'] += chunk.get('prompt_eval_count') or 0
+    usage['completion'] += chunk.get('eval_count') or 0
+    if chunk.get('eval_count'):
+        calibrate_tokens(chars, chunk['eval_count'])
+
+async def ollama_complete(prompt, usage):
+    """Réponse complète d'Ollama (sans streaming); tokens ajoutés à usage"""
+    payload = {
+        'model': OLLAMA_LLM_MODEL,
+        'prompt': prompt,
+        'stream': False,
+        'options': {'temperature': OLLAMA_TEMPERATURE},
+    }
+    res = await http_client.post('/api/generate', json=payload)
+    res.raise_for_status()
+    chunk = res.json()
+    if chunk.get('error'):
+        raise RuntimeError(chunk['error'])
+    response = chunk.get('response', '')
+    count_usage(usage, chunk, len(response))
+    return response
+
+async def condense_message(message, usage):
+    """Équivalent asynchrone de appchatbot.condense_message.
+
+    Les morceaux sont résumés l'un après l'autre, dans le slot de génération
+    de la requête: en parallèle, un seul message dépasserait
+    GENERATION_CONCURRENCY.
+    """
+    if estimate_tokens(message) <= MAX_MESSAGE_TOKENS:
+        return message
+    prompts, tail = long_message_prompts(message)
+    summaries = [await ollama_complete(p, usage) for p in prompts]
+    return assemble_condensed(summaries, tail)
+
+async def ollama_tokens(prompt, usage):
+    """Tokens générés par Ollama (/api/generate en streaming), via le pool HTTP.
+
+    Les comptes de tokens du dernier morceau sont ajoutés à usage. Annuler la
+    tâche ferme la connexion, ce qui interrompt la génération.
+    """
+    payload = {
+        'model': OLLAMA_LLM_MODEL,
+        'prompt': prompt,
+        'stream': True,
+        'options': {'temperature': OLLAMA_TEMPERATURE},
+    }
+    chars = 0
+    async with http_client.stream('POST', '/api/generate', json=payload) as res:
+        res.raise_for_status()
+        async for line in res.aiter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get('error'):
+                raise RuntimeError(chunk['error'])
+            if chunk.get('response'):
+                chars += len(chunk['response'])
+                yield chunk['response']
+            if chunk.get('done'):
+                count_usage(usage, chunk, chars)
+                break
+
+async def lookup_cache(message, user_id, mode, exclude_message_id=None, file_ids=None):
+    """lookup_response_cache (avant de prendre un slot), passages via chat_prompt_parts"""
+    return await run_sync(lookup_response_cache, message, user_id, mode, exclude_message_id, file_ids, chat_prompt_parts)
+
+async def stream_response(message, user_id, exclude_message_id=None, mode='stream', file_ids=None, prepared=None):
+    """Équivalent asynchrone de stream_ai_response (métriques et tokens compris)"""
+    usage = {'prompt': 0, 'completion': 0}
+    try:
+        if prepared is not None:
+            context, history, key = prepared
+        else:
+            message = await condense_message(message, usage)
+            context, history = await run_sync(chat_prompt_parts, message, user_id, exclude_message_id, file_ids)
+            key = None
+        start = time.perf_counter()
+        prompt = build_prompt(message, context, history)
+        parts = []
+        try:
+            async for token in ollama_tokens(prompt, usage):
+                parts.append(token)
+                yield token
+        except (asyncio.CancelledError, GeneratorExit):
+            record_generation(user_id, mode, 'interrupted')
+            # génération interrompue: pas de comptes Ollama, on estime
+            usage['prompt'] += estimate_tokens(prompt)
+            usage['completion'] += len(parts)
+            raise
+        record_generation(user_id, mode, 'generated', time.perf_counter() - start, len(parts))
+        if key is not None:
+            response_cache.set(key, ''.join(parts))
+    except Exception as e:
+        record_generation(user_id, mode, 'error')
+        yield f"❌ Erreur lors de la génération de la réponse: {str(e)}"
+    finally:
+        await persist(record_token_usage, user_id, usage['prompt'], usage['completion'])
+
+# ============= ACCÈS BASE DE DONNÉES =============
+
+def save_exchange(user_id, message, response):
+    chat_message = ChatMessage(user_id=user_id, message=message, response=response)
+    db.session.add(chat_message)
+    db.session.commit()
+    schedule_summary_update(user_id)
+    return chat_message.id
+
+def create_pending_message(user_id, message):
+    chat_message = ChatMessage(user_id=user_id, message=message, response='')
+    db.session.add(chat_message)
+    db.session.commit()
+    return chat_message.id
+
+def save_response(message_id, response):
+    ChatMessage.query.filter_by(id=message_id).update({'response': response})
+    db.session.commit()
+
+def finish_response(user_id, message_id, response):
+    save_response(message_id, response)
+    schedule_summary_update(user_id)
+
+def delete_message(message_id):
+    ChatMessage.query.filter_by(id=message_id).delete()
+    db.session.commit()
+
+# ============= ROUTES =============
+
+@instrumented('/api/chat')
+async def chat(request):
+    """Envoie un message et reçoit une réponse IA"""
+    user_id = session_user_id(request)
+    if user_id is None:
+        return JSONResponse({'success': False, 'message': 'Non authentifié'})
+    data = await read_json(request)
+    message = data.get('message')
+    if not message:
+        return JSONResponse({'success': False, 'message': 'Message vide'})
+
+    # Sélection optionnelle des fichiers interrogés
+    file_ids, error = await run_sync(resolve_file_scope, user_id, data.get('file_ids'))
+    if error:
+        return JSONResponse({'success': False, 'message': error})
+
+    refused = await run_sync(check_generation_allowed, user_id, message)
+    if refused:
+        return JSONResponse({'success': False, 'message': refused[0]}, status_code=refused[1])
+
+    # Réponse en cache: servie sans prendre de slot de génération
+    ai_response, prepared = await lookup_cache(message, user_id, 'invoke', file_ids=file_ids)
+    if ai_response is None:
+        # Attente de notre tour dans la file équitable (sans thread bloqué)
+        ticket = generation_scheduler.enqueue(user_id)
+        ready = watch_ticket(ticket)
+        try:
+            async for _ in wait_turn(ticket, ready):
+                pass
+            if ticket.shed:
+                return JSONResponse({'success': False, 'message': SHED_MESSAGE}, status_code=503)
+            ai_response = ''.join([
+                token async for token in stream_response(message, user_id, mode='invoke', file_ids=file_ids, prepared=prepared)
+            ])
+        finally:
+            generation_scheduler.release(ticket)
+
+    await run_sync(save_exchange, user_id, message, ai_response)
+    return JSONResponse({'success': True, 'response': ai_response})
+
+@instrumented('/api/chat/stream')
+async def chat_stream(request):
+    """Envoie un message et reçoit la réponse IA en streaming (SSE)"""
+    user_id = session_user_id(request)
+    if user_id is None:
+        return JSONResponse({'success': False, 'message': 'Non authentifié'})
+    data = await read_json(request)
+    message = data.get('message')
+    if not message:
+        return JSONResponse({'success': False, 'message': 'Message vide'})
+
+    # Sélection optionnelle des fichiers interrogés
+    file_ids, error = await run_sync(resolve_file_scope, user_id, data.get('file_ids'))
+    if error:
+        return JSONResponse({'success': False, 'message': error})
+
+    refused = await run_sync(check_generation_allowed, user_id, message)
+    if refused:
+        return JSONResponse({'success': False, 'message': refused[0]}, status_code=refused[1])
+
+    # Cherché avant de créer la ligne: elle ne fait pas partie de l'historique
+    cached, prepared = await lookup_cache(message, user_id, 'stream', file_ids=file_ids)
+    if cached is not None:
+        message_id = await run_sync(save_exchange, user_id, message, cached)
+
+        async def replay():
+            # réponse en cache: ni slot ni file d'attente
+            yield sse({'token': cached})
+            yield sse({'done': True, 'message_id': message_id})
+
+        return StreamingResponse(
+            replay(),
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    # La ligne est créée tout de suite puis complétée au fil de la génération
+    message_id = await run_sync(create_pending_message, user_id, message)
+
+    async def generate():
+        parts = []
+        last_save = time.monotonic()
+        completed = False
+        ticket = generation_scheduler.enqueue(user_id)
+        ready = watch_ticket(ticket)
+        try:
+            async for position in wait_turn(ticket, ready):
+                yield sse({'queue_position': position})
+            if ticket.shed:
+                yield sse({'error': SHED_MESSAGE})
+                return
+
+            async for token in stream_response(message, user_id, exclude_message_id=message_id, file_ids=file_ids, prepared=prepared):
+                parts.append(token)
+                yield sse({'token': token})
+                if time.monotonic() - last_save >= STREAM_PERSIST_SECONDS:
+                    await run_sync(save_response, message_id, ''.join(parts))
+                    last_save = time.monotonic()
+            completed = True
+            yield sse({'done': True, 'message_id': message_id})
+        finally:
+            generation_scheduler.release(ticket)
+            if not ticket.granted:
+                # jamais servi (abandonné ou client parti en attente): pas de message
+                await persist(delete_message, message_id)
+            else:
+                response = ''.join(parts)
+                if not completed:
+                    response += ' [interrompu]'
+                await persist(finish_response, user_id, message_id, response)
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# ============= APPLICATION =============
+
+@asynccontextmanager
+async def lifespan(_):
+    global http_client
+    start_background_tasks()
+
+    http_client = httpx.AsyncClient(
+        base_url=OLLAMA_BASE_URL,
+        # pas de limite de lecture: une génération peut durer plusieurs minutes
+        timeout=httpx.Timeout(None, connect=OLLAMA_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=OLLAMA_MAX_CONNECTIONS, max_keepalive_connections=OLLAMA_MAX_CONNECTIONS),
+    )
+    print(f"🚀 Serveur asynchrone prêt (Ollama: {OLLAMA_BASE_URL}, {OLLAMA_MAX_CONNECTIONS} connexions max)")
+    try:
+        yield
+    finally:
+        # réponses de clients déconnectés encore en cours d'écriture
+        await asyncio.gather(*pending_writes, return_exceptions=True)
+        await http_client.aclose()
+
+app = Starlette(
+    routes=[
+        Route('/api/chat', chat, methods=['POST']),
+        Route('/api/chat/stream', chat_stream, methods=['POST']),
+        # tout le reste: l'application Flask
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,180 @@
+"""
+Test de fumée du serveur asynchrone (asgi_app.py), contre le faux Ollama de loadtest.py.
+
+Démarre le faux Ollama puis asgi_app sous uvicorn (lifespan compris), dans un
+dossier et une base SQLite temporaires, et vérifie:
+- /api/chat/stream: tokens puis `done`, réponse et tokens enregistrés en base;
+- /api/chat: réponse complète enregistrée;
+- client déconnecté en cours de streaming: réponse partielle marquée
+  [interrompu] et tokens comptés malgré l'annulation de la tâche.
+
+Usage (code de sortie non nul en cas d'échec):
+pip install starlette uvicorn httpx a2wsgi
+python asgi_smoke.py
+"""
+
+import http.client
+import http.cookiejar
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from loadtest import HERE, start_fake_ollama
+
+
+def start_server(workdir):
+    """Importe asgi_app (après configuration de l'environnement) et la sert avec uvicorn"""
+    import uvicorn
+
+    os.chdir(workdir)
+    sys.path.insert(0, HERE)
+    import asgi_app
+
+    config = uvicorn.Config(asgi_app.app, host='127.0.0.1', port=0, lifespan='on', log_level='warning')
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True, name='asgi-server').start()
+    deadline = time.monotonic() + 30
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("uvicorn n'a pas démarré")
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, port
+
+
+def stream_events(conn, cookie, message):
+    """Envoie /api/chat/stream et renvoie la réponse HTTP (lecture événement par événement)"""
+    conn.request('POST', '/api/chat/stream', body=json.dumps({'message': message}),
+                 headers={'Content-Type': 'application/json', 'Cookie': cookie})
+    res = conn.getresponse()
+    if res.status != 200:
+        raise AssertionError(f"statut {res.status}")
+    return res
+
+
+def read_event(res):
+    while True:
+        line = res.readline()
+        if not line:
+            return None
+        if line.startswith(b'data: '):
+            return json.loads(line[6:])
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.1)
+    return condition()
+
+
+def main():
+    fake = start_fake_ollama(latency=0.05, token_rate=20, tokens=20, embed_latency=0)
+    workdir = tempfile.mkdtemp(prefix='asgi_smoke_')
+    os.environ['OLLAMA_BASE_URL'] = f"http://127.0.0.1:{fake.server_port}"
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'smoke.db')}"
+
+    server, port = start_server(workdir)
+    from appchatbot import app as flask_app, db, User, ChatMessage, TokenUsage
+    base_url = f"http://127.0.0.1:{port}"
+    print(f"🧪 asgi_app: {base_url} — faux Ollama: {os.environ['OLLAMA_BASE_URL']} — dossier: {workdir}")
+
+    # inscription via l'application Flask montée sous l'ASGI
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    req = urllib.request.Request(
+        base_url + '/api/register', method='POST', headers={'Content-Type': 'application/json'},
+        data=json.dumps({'username': 'smoke', 'email': 'smoke@example.com', 'password': 'smoke'}).encode(),
+    )
+    with opener.open(req, timeout=30) as res:
+        assert json.loads(res.read()).get('success'), "inscription refusée"
+    cookie = '; '.join(f"{c.name}={c.value}" for c in jar)
+
+    with flask_app.app_context():
+        user_id = db.session.query(User.id).filter_by(username='smoke').scalar()
+
+    def stored(message_id):
+        with flask_app.app_context():
+            db.session.remove()
+            return db.session.get(ChatMessage, message_id).response
+
+    def usage():
+        with flask_app.app_context():
+            db.session.remove()
+            row = TokenUsage.query.filter_by(user_id=user_id).first()
+            return (row.requests, row.completion_tokens) if row else (0, 0)
+
+    failures = []
+
+    def check(name, ok, detail=''):
+        print(f"{'✅' if ok else '❌'} {name}{' — ' + detail if detail else ''}")
+        if not ok:
+            failures.append(name)
+
+    # 1. streaming complet
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    res = stream_events(conn, cookie, 'Bonjour')
+    tokens, done = [], None
+    while True:
+        event = read_event(res)
+        if event is None or 'error' in event:
+            break
+        if 'token' in event:
+            tokens.append(event['token'])
+        if event.get('done'):
+            done = event
+            break
+    conn.close()
+    check('stream: tokens puis done', bool(tokens) and done is not None, f"{len(tokens)} tokens")
+    if done:
+        # la réponse finale est écrite après l'envoi de `done`
+        check('stream: réponse enregistrée', wait_for(lambda: stored(done['message_id']) == ''.join(tokens)))
+    check('stream: tokens comptés', wait_for(lambda: usage()[1] >= len(tokens)), f"(requêtes, tokens) = {usage()}")
+
+    # 2. réponse non streamée
+    before = usage()[0]
+    req = urllib.request.Request(
+        base_url + '/api/chat', method='POST', headers={'Content-Type': 'application/json'},
+        data=json.dumps({'message': 'Que peux-tu faire ?'}).encode(),
+    )
+    with opener.open(req, timeout=30) as res:
+        data = json.loads(res.read())
+    check('chat: réponse', bool(data.get('success') and data.get('response')))
+    check('chat: tokens comptés', wait_for(lambda: usage()[0] > before))
+
+    # 3. client déconnecté après le premier token
+    before = usage()[0]
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    res = stream_events(conn, cookie, 'Interruption')
+    while True:
+        event = read_event(res)
+        if event is None or 'token' in event:
+            break
+    conn.sock.close()
+    conn.close()
+    with flask_app.app_context():
+        message_id = db.session.query(db.func.max(ChatMessage.id)).scalar()
+
+    def interrupted():
+        response = stored(message_id)
+        return response if response.endswith(' [interrompu]') else None
+
+    check('déconnexion: réponse partielle enregistrée', bool(wait_for(interrupted)), repr(interrupted()))
+    check('déconnexion: tokens comptés', wait_for(lambda: usage()[0] > before))
+
+    server.should_exit = True
+    if failures:
+        print(f"❌ {len(failures)} échec(s)")
+        sys.exit(1)
+    print("✅ asgi_app OK")
+
+
+if __name__ == '__main__':
+    main()
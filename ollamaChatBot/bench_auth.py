@@ -0,0 +1,96 @@
+"""
+Test de charge des routes d'authentification, avec et sans cache de session.
+
+Mesure le débit (requêtes/s) de /api/check-session (appelée à chaque
+chargement de page) et de /api/register, en appelant l'application en
+process via le client de test Flask, sur une base SQLite temporaire.
+
+Usage:
+python bench_auth.py --threads 8 --seconds 5
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+# Base temporaire, à définir avant l'import de l'application
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench_auth_'), 'bench.db')}")
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+import appchatbot  # noqa: E402
+from appchatbot import app, db, user_cache  # noqa: E402
+
+# Le hachage du mot de passe domine l'inscription: on l'allège pour mesurer la base
+appchatbot.generate_password_hash = lambda password: generate_password_hash(password, method='pbkdf2:sha256:1')
+
+
+def run(threads, seconds, target):
+    stop = time.monotonic() + seconds
+    counts = [0] * threads
+
+    def worker(n):
+        client = app.test_client()
+        state = {'n': 0}
+        target(client, n, state, setup=True)
+        while time.monotonic() < stop:
+            target(client, n, state)
+            counts[n] += 1
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return sum(counts) / seconds
+
+
+def check_session(client, n, state, setup=False):
+    if setup:
+        creds = {'username': f'bench{n}', 'email': f'bench{n}@x', 'password': 'x'}
+        if not client.post('/api/register', json=creds).json['success']:
+            client.post('/api/login', json=creds)
+        assert client.get('/api/check-session').json['logged_in']
+        return
+    client.get('/api/check-session')
+
+
+def register(client, n, state, setup=False):
+    if setup:
+        return
+    state['n'] += 1
+    uid = f"{n}_{state['n']}_{time.monotonic_ns()}"
+    client.post('/api/register', json={'username': f'u{uid}', 'email': f'{uid}@x', 'password': 'x'})
+    # une inscription sur deux est un doublon (chemin IntegrityError)
+    client.post('/api/register', json={'username': f'u{uid}', 'email': f'{uid}@x', 'password': 'x'})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+
+    ttl = user_cache.ttl
+    user_cache.ttl = 0
+    user_cache.clear()
+    no_cache = run(args.threads, args.seconds, check_session)
+    user_cache.ttl = ttl
+    user_cache.hits = user_cache.misses = 0
+    cached = run(args.threads, args.seconds, check_session)
+    reg = run(args.threads, args.seconds, register) * 2
+
+    print(f"{args.threads} threads, {args.seconds:.0f}s par scénario\n")
+    print(f"/api/check-session sans cache : {no_cache:8.0f} req/s")
+    print(f"/api/check-session avec cache : {cached:8.0f} req/s  (x{cached / no_cache if no_cache else 0:.2f}, "
+          f"{user_cache.hits} hits / {user_cache.misses} misses)")
+    print(f"/api/register (dont 50% doublons) : {reg:8.0f} req/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""
+Benchmark de contention en écriture sur SQLite: profil 'stock' vs 'tuned'.
+
+Simule des utilisateurs qui enregistrent des messages de chat en parallèle
+(INSERT + COMMIT, comme /api/chat) pendant que d'autres lisent leur
+historique (comme /api/history). Chaque profil tourne sur une base
+temporaire avec le schéma de l'application.
+
+Avec --search: latence de la recherche plein texte (/api/history/search) sur
+une base de nombreux utilisateurs, filtre utilisateur dans FTS5 (actuel)
+contre filtre après classement de tout le corpus (ancien).
+
+Usage:
+python bench_sqlite.py --writers 16 --readers 4 --seconds 10
+python bench_sqlite.py --search --users 2000 --messages 50
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, event, select, text
+from sqlalchemy.exc import OperationalError
+
+from appchatbot import (
+    db, ChatMessage, User, engine_options, apply_sqlite_pragmas,
+    FTS_SETUP_SQL, fts_query, fts_search,
+)
+
+
+def make_engine(path, profile):
+    uri = f"sqlite:///{path}"
+    engine = create_engine(uri, **engine_options(uri, profile))
+    event.listen(engine, 'connect', lambda conn, _: apply_sqlite_pragmas(conn, profile))
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [
+            {'id': i, 'username': f'user{i}', 'email': f'user{i}@bench', 'password': 'x'}
+            for i in range(1, 101)
+        ])
+    return engine
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(profile, writers, readers, seconds):
+    tmpdir = tempfile.mkdtemp(prefix='bench_sqlite_')
+    engine = make_engine(os.path.join(tmpdir, 'bench.db'), profile)
+    table = ChatMessage.__table__
+    stop = time.monotonic() + seconds
+    lock = threading.Lock()
+    stats = {'writes': 0, 'reads': 0, 'errors': 0, 'write_latencies': []}
+
+    def writer(n):
+        user_id = n % 100 + 1
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    conn.execute(table.insert().values(
+                        user_id=user_id,
+                        message='Question de test ' * 10,
+                        response='Réponse générée par le modèle ' * 40,
+                        timestamp=datetime.utcnow()
+                    ))
+            except OperationalError:
+                with lock:
+                    stats['errors'] += 1
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                stats['writes'] += 1
+                stats['write_latencies'].append(elapsed)
+
+    def reader(n):
+        user_id = n % 100 + 1
+        query = select(table).where(table.c.user_id == user_id).order_by(table.c.timestamp.desc()).limit(50)
+        while time.monotonic() < stop:
+            try:
+                with engine.connect() as conn:
+                    conn.execute(query).fetchall()
+            except OperationalError:
+                with lock:
+                    stats['errors'] += 1
+                continue
+            with lock:
+                stats['reads'] += 1
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    engine.dispose()
+
+    lat = stats['write_latencies']
+    return {
+        'profile': profile,
+        'writes_per_s': stats['writes'] / seconds,
+        'reads_per_s': stats['reads'] / seconds,
+        'p50_ms': percentile(lat, 0.50) * 1000,
+        'p99_ms': percentile(lat, 0.99) * 1000,
+        'errors': stats['errors'],
+    }
+
+
+# Vocabulaire partagé: quelques mots très fréquents (présents chez tous les
+# utilisateurs) et une longue traîne de mots rares
+COMMON_WORDS = "document réponse question modèle contexte fichier".split()
+RARE_WORDS = [f"terme{i}" for i in range(5000)]
+
+
+def random_text(rng, words):
+    return ' '.join(
+        rng.choice(COMMON_WORDS) if rng.random() < 0.3 else rng.choice(RARE_WORDS)
+        for _ in range(words)
+    )
+
+
+def unscoped_search(conn, user_id, q, limit):
+    # ancienne requête: MATCH et bm25 sur les messages de tous les utilisateurs
+    match = fts_query(q)
+    return conn.execute(text("""
+        SELECT m.id FROM chat_message_fts
+        JOIN chat_message m ON m.id = chat_message_fts.rowid
+        WHERE chat_message_fts MATCH :match AND m.user_id = :user_id
+        ORDER BY bm25(chat_message_fts)
+        LIMIT :limit
+    """), {'match': match, 'user_id': user_id, 'limit': limit}).fetchall()
+
+
+def run_search(users, messages, queries):
+    tmpdir = tempfile.mkdtemp(prefix='bench_fts_')
+    uri = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    engine = create_engine(uri, **engine_options(uri, 'tuned'))
+    event.listen(engine, 'connect', lambda conn, _: apply_sqlite_pragmas(conn, 'tuned'))
+    db.metadata.create_all(engine)
+    rng = random.Random(42)
+
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        for statement in FTS_SETUP_SQL:
+            conn.execute(text(statement))
+        conn.execute(User.__table__.insert(), [
+            {'id': i, 'username': f'user{i}', 'email': f'user{i}@bench', 'password': 'x'}
+            for i in range(1, users + 1)
+        ])
+        for user_id in range(1, users + 1):
+            conn.execute(ChatMessage.__table__.insert(), [
+                {
+                    'user_id': user_id,
+                    'message': random_text(rng, 12),
+                    'response': random_text(rng, 60),
+                    'timestamp': datetime.utcnow()
+                }
+                for _ in range(messages)
+            ])
+    print(f"{users * messages} messages indexés en {time.perf_counter() - start:.1f}s\n")
+
+    cases = [
+        ('mot fréquent', lambda: rng.choice(COMMON_WORDS)),
+        ('préfixe fréquent', lambda: rng.choice(COMMON_WORDS)[:3]),
+        ('mot rare', lambda: rng.choice(RARE_WORDS)),
+    ]
+    print(f"{'requête':<18} {'filtre':<11} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+    with engine.connect() as conn:
+        for label, make_query in cases:
+            for name, search in (('FTS5', fts_search), ('jointure', unscoped_search)):
+                latencies = []
+                for _ in range(queries):
+                    q = make_query()
+                    user_id = rng.randint(1, users)
+                    t = time.perf_counter()
+                    search(conn, user_id, q, 20)
+                    latencies.append(time.perf_counter() - t)
+                print(f"{label:<18} {name:<11} {percentile(latencies, 0.50) * 1000:>9.1f} "
+                      f"{percentile(latencies, 0.99) * 1000:>9.1f}")
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=16)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--search', action='store_true', help='benchmark de la recherche plein texte')
+    parser.add_argument('--users', type=int, default=2000, help='utilisateurs (--search)')
+    parser.add_argument('--messages', type=int, default=50, help='messages par utilisateur (--search)')
+    parser.add_argument('--queries', type=int, default=200, help='requêtes par cas (--search)')
+    args = parser.parse_args()
+
+    if args.search:
+        run_search(args.users, args.messages, args.queries)
+        return
+
+    print(f"{args.writers} écrivains, {args.readers} lecteurs, {args.seconds:.0f}s par profil\n")
+    print(f"{'profil':<8} {'écritures/s':>12} {'lectures/s':>11} {'p50 (ms)':>9} {'p99 (ms)':>9} {'erreurs':>8}")
+    for profile in ('stock', 'tuned'):
+        r = run(profile, args.writers, args.readers, args.seconds)
+        print(f"{r['profile']:<8} {r['writes_per_s']:>12.0f} {r['reads_per_s']:>11.0f} "
+              f"{r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
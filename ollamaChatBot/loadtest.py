@@ -0,0 +1,456 @@
+"""
+Test de charge de bout en bout de l'application, contre un faux serveur Ollama.
+
+Démarre dans le même process:
+- un faux Ollama (API /api/generate, /api/chat, /api/embeddings, /api/embed)
+  avec une latence avant le premier token et un débit de tokens réglables;
+- l'application sur un vrai serveur HTTP multi-thread, dans un dossier et une
+  base SQLite temporaires.
+
+Puis simule des utilisateurs qui suivent un parcours réaliste: inscription,
+upload d'un PDF (attente de l'indexation), quelques messages (normaux et en
+streaming) entrecoupés de temps de réflexion, navigation dans l'historique.
+Affiche le débit et les latences (p50/p95/p99/max) par étape, avec la
+configuration SQLite / workers utilisée.
+
+Usage:
+python loadtest.py --users 200 --ramp 20 --chats 3
+python loadtest.py --users 100 --db-profile stock --generation-concurrency 4 --json report.json
+"""
+
+import argparse
+import hashlib
+import http.cookiejar
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# ============= FAUX OLLAMA =============
+
+WORDS = ("le la les un une des de du et à en pour avec sur dans document réponse "
+         "question modèle contexte utilisateur fichier exemple données").split()
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """Imite les routes d'Ollama utilisées par LangChain.
+
+    Réglages (attributs du serveur): latency (s avant le premier token),
+    token_rate (tokens/s), tokens (tokens par réponse), embed_latency (s par
+    appel d'embedding), dim (taille des vecteurs).
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _send_json(self, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _vector(self, text):
+        # vecteur déterministe: même texte -> même embedding
+        seed = hashlib.sha256(text.encode('utf-8')).digest()
+        rng = random.Random(seed)
+        return [rng.uniform(-1, 1) for _ in range(self.server.dim)]
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send_json({'models': [{'name': 'fake'}]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        body = self._body()
+        if self.path in ('/api/embeddings', '/api/embed'):
+            time.sleep(self.server.embed_latency)
+            if self.path == '/api/embeddings':
+                self._send_json({'embedding': self._vector(body.get('prompt', ''))})
+            else:
+                inputs = body.get('input', [])
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                self._send_json({'embeddings': [self._vector(t) for t in inputs]})
+        elif self.path in ('/api/generate', '/api/chat'):
+            self._generate(body, chat=self.path == '/api/chat')
+        else:
+            self.send_error(404)
+
+    def _generate(self, body, chat):
+        model = body.get('model', 'fake')
+        stream = body.get('stream', True)
+        rng = random.Random()
+        tokens = [rng.choice(WORDS) + ' ' for _ in range(self.server.tokens)]
+        time.sleep(self.server.latency)
+        interval = 1.0 / self.server.token_rate if self.server.token_rate > 0 else 0
+
+        def chunk(text, done):
+            payload = {'model': model, 'created_at': '', 'done': done}
+            if chat:
+                payload['message'] = {'role': 'assistant', 'content': text}
+            else:
+                payload['response'] = text
+            if done:
+                prompt = body.get('prompt') or ''.join(m.get('content', '') for m in body.get('messages', []))
+                payload.update(prompt_eval_count=len(prompt) // 4 + 1, eval_count=len(tokens), done_reason='stop')
+            return payload
+
+        if not stream:
+            time.sleep(interval * len(tokens))
+            self._send_json(chunk(''.join(tokens), True))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for token in tokens:
+                self._write_chunk(json.dumps(chunk(token, False)) + '\n')
+                time.sleep(interval)
+            self._write_chunk(json.dumps(chunk('', True)) + '\n')
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # client parti: la génération s'arrête, comme avec le vrai Ollama
+            self.close_connection = True
+
+    def _write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b'\r\n')
+        self.wfile.flush()
+
+
+def start_fake_ollama(latency, token_rate, tokens, embed_latency, dim=768):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOllamaHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.token_rate = token_rate
+    server.tokens = tokens
+    server.embed_latency = embed_latency
+    server.dim = dim
+    threading.Thread(target=server.serve_forever, daemon=True, name='fake-ollama').start()
+    return server
+
+
+# ============= DONNÉES DE TEST =============
+
+def make_pdf(text):
+    """Petit PDF valide d'une page contenant `text`"""
+    stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode('latin-1')
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+        b"/Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>",
+        b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n".encode() + obj + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def multipart(field, filename, content, content_type='application/pdf'):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+QUESTIONS = [
+    "Que peux-tu faire ?",
+    "Résume le document que je viens d'envoyer.",
+    "Quels sont les points importants ?",
+    "Explique-moi ce passage plus simplement.",
+    "Donne-moi un exemple concret.",
+]
+
+
+# ============= MESURES =============
+
+# Ordre d'affichage: celui du parcours
+STEP_ORDER = [
+    'register', 'upload', 'files (polling)', 'upload -> indexé', 'chat',
+    'chat_stream (1er token)', 'chat_stream (complet)', 'history', 'history (page suivante)',
+]
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}  # étape -> [secondes]
+        self.errors = {}     # étape -> nombre
+
+    def record(self, step, seconds, ok=True):
+        with self._lock:
+            self.latencies.setdefault(step, []).append(seconds)
+            if not ok:
+                self.errors[step] = self.errors.get(step, 0) + 1
+
+    @staticmethod
+    def percentile(values, p):
+        if not values:
+            return 0.0
+        values = sorted(values)
+        index = min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))
+        return values[index]
+
+    def summary(self, elapsed):
+        rows = []
+        order = {step: i for i, step in enumerate(STEP_ORDER)}
+        for step, values in sorted(self.latencies.items(), key=lambda item: order.get(item[0], len(order))):
+            rows.append({
+                'step': step,
+                'count': len(values),
+                'errors': self.errors.get(step, 0),
+                'per_second': round(len(values) / elapsed, 2) if elapsed else 0,
+                'p50_ms': round(self.percentile(values, 50) * 1000, 1),
+                'p95_ms': round(self.percentile(values, 95) * 1000, 1),
+                'p99_ms': round(self.percentile(values, 99) * 1000, 1),
+                'max_ms': round(max(values) * 1000, 1),
+            })
+        return rows
+
+
+# ============= PARCOURS UTILISATEUR =============
+
+class VirtualUser:
+    def __init__(self, base_url, stats, n, args):
+        self.base_url = base_url
+        self.stats = stats
+        self.n = n
+        self.args = args
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def request(self, step, method, path, payload=None, body=None, content_type=None, record=True):
+        headers = {}
+        if payload is not None:
+            body = json.dumps(payload).encode()
+            content_type = 'application/json'
+        if content_type:
+            headers['Content-Type'] = content_type
+        req = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers)
+        start = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=self.args.timeout) as res:
+                data = json.loads(res.read() or b'{}')
+            ok = data.get('success', True) is not False
+        except (urllib.error.URLError, OSError, ValueError):
+            data, ok = {}, False
+        if record:
+            self.stats.record(step, time.perf_counter() - start, ok)
+        return data
+
+    def chat_stream(self, message):
+        body = json.dumps({'message': message}).encode()
+        req = urllib.request.Request(self.base_url + '/api/chat/stream', data=body, method='POST',
+                                     headers={'Content-Type': 'application/json'})
+        start = time.perf_counter()
+        first = None
+        ok = False
+        try:
+            with self.opener.open(req, timeout=self.args.timeout) as res:
+                for line in res:
+                    if not line.startswith(b'data: '):
+                        continue
+                    event = json.loads(line[6:])
+                    if 'token' in event and first is None:
+                        first = time.perf_counter() - start
+                    if 'error' in event:
+                        break
+                    if event.get('done'):
+                        ok = True
+                        break
+        except (urllib.error.URLError, OSError, ValueError):
+            pass
+        if first is not None:
+            self.stats.record('chat_stream (1er token)', first)
+        self.stats.record('chat_stream (complet)', time.perf_counter() - start, ok)
+
+    def think(self):
+        if self.args.think > 0:
+            time.sleep(random.uniform(0.5, 1.5) * self.args.think)
+
+    def run(self):
+        name = f"load{self.n}_{uuid.uuid4().hex[:8]}"
+        self.request('register', 'POST', '/api/register',
+                     {'username': name, 'email': f'{name}@example.com', 'password': 'loadtest'})
+
+        if random.random() < self.args.upload_ratio:
+            # contenu propre à l'utilisateur sauf pour une partie (déduplication)
+            shared = random.random() < self.args.shared_ratio
+            text = "Document commun de test" if shared else f"Document de {name} numero {self.n}"
+            body, content_type = multipart('file', f'{name}.pdf', make_pdf(text))
+            start = time.perf_counter()
+            res = self.request('upload', 'POST', '/api/upload', body=body, content_type=content_type)
+            if res.get('job_id'):
+                self.wait_indexed(start)
+
+        for i in range(self.args.chats):
+            self.think()
+            message = random.choice(QUESTIONS)
+            if random.random() < self.args.stream_ratio:
+                self.chat_stream(message)
+            else:
+                self.request('chat', 'POST', '/api/chat', {'message': message})
+
+        self.think()
+        page = self.request('history', 'GET', '/api/history?limit=20')
+        for _ in range(2):
+            if not page.get('has_more'):
+                break
+            page = self.request('history (page suivante)', 'GET',
+                                f"/api/history?limit=20&before={page['before']}")
+
+    def wait_indexed(self, start):
+        deadline = time.monotonic() + self.args.timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.5)
+            files = self.request('files (polling)', 'GET', '/api/files').get('files') or []
+            statuses = {f['status'] for f in files}
+            if statuses and not statuses & {'queued', 'processing'}:
+                self.stats.record('upload -> indexé', time.perf_counter() - start, 'failed' not in statuses)
+                return
+        self.stats.record('upload -> indexé', time.perf_counter() - start, False)
+
+
+# ============= ORCHESTRATION =============
+
+def start_app(workdir):
+    """Importe l'application (après configuration de l'environnement) et la sert en HTTP"""
+    from werkzeug.serving import make_server
+
+    os.chdir(workdir)
+    sys.path.insert(0, HERE)
+    import appchatbot
+
+    appchatbot.init_langchain()
+    appchatbot.start_background_tasks()
+
+    # une ligne de log par requête fausserait les mesures
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, appchatbot.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True, name='app-server').start()
+    return appchatbot, f"http://127.0.0.1:{server.server_port}"
+
+
+def print_report(rows, config, elapsed):
+    print("\n" + "=" * 78)
+    print("Configuration: " + ", ".join(f"{k}={v}" for k, v in config.items()))
+    print(f"Durée: {elapsed:.1f}s")
+    print("=" * 78)
+    print(f"{'étape':<26}{'n':>6}{'err':>5}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for r in rows:
+        print(f"{r['step']:<26}{r['count']:>6}{r['errors']:>5}{r['per_second']:>8.1f}"
+              f"{r['p50_ms']:>9.0f}{r['p95_ms']:>9.0f}{r['p99_ms']:>9.0f}{r['max_ms']:>9.0f}")
+    print("(latences en ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50, help='utilisateurs simulés')
+    parser.add_argument('--ramp', type=float, default=10, help='montée en charge (s)')
+    parser.add_argument('--chats', type=int, default=3, help='messages par utilisateur')
+    parser.add_argument('--think', type=float, default=1.0, help='temps de réflexion moyen (s)')
+    parser.add_argument('--stream-ratio', type=float, default=0.5, help='part des messages en streaming')
+    parser.add_argument('--upload-ratio', type=float, default=0.5, help='part des utilisateurs qui envoient un PDF')
+    parser.add_argument('--shared-ratio', type=float, default=0.2, help='part des PDFs identiques entre utilisateurs')
+    parser.add_argument('--timeout', type=float, default=300)
+    # faux Ollama
+    parser.add_argument('--llm-latency', type=float, default=0.3, help='délai avant le premier token (s)')
+    parser.add_argument('--token-rate', type=float, default=50, help='tokens/s par génération')
+    parser.add_argument('--tokens', type=int, default=100, help='tokens par réponse')
+    parser.add_argument('--embed-latency', type=float, default=0.02, help='durée d\'un appel d\'embedding (s)')
+    # configuration de l'application (variables d'environnement lues à l'import)
+    parser.add_argument('--db-profile', choices=['tuned', 'stock'])
+    parser.add_argument('--database-url', help='par défaut: base SQLite temporaire')
+    parser.add_argument('--pdf-workers', type=int)
+    parser.add_argument('--generation-concurrency', type=int)
+    parser.add_argument('--json', help='écrit aussi le rapport en JSON dans ce fichier')
+    args = parser.parse_args()
+
+    fake = start_fake_ollama(args.llm_latency, args.token_rate, args.tokens, args.embed_latency)
+    workdir = tempfile.mkdtemp(prefix='loadtest_')
+    env = {
+        'OLLAMA_BASE_URL': f"http://127.0.0.1:{fake.server_port}",
+        'DATABASE_URL': args.database_url or f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        'DB_PROFILE': args.db_profile,
+        'PDF_WORKERS': args.pdf_workers,
+        'GENERATION_CONCURRENCY': args.generation_concurrency,
+    }
+    for key, value in env.items():
+        if value is not None:
+            os.environ[key] = str(value)
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    app_module, base_url = start_app(workdir)
+    config = {
+        'users': args.users,
+        'db': app_module.app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0],
+        'DB_PROFILE': app_module.DB_PROFILE,
+        'PDF_WORKERS': app_module.PDF_WORKERS,
+        'GENERATION_CONCURRENCY': app_module.GENERATION_CONCURRENCY,
+        'ia': app_module.ai_state['status'],
+        'llm': f"{args.llm_latency}s + {args.tokens} tokens @ {args.token_rate}/s",
+    }
+    print(f"🧪 Application: {base_url} — faux Ollama: {env['OLLAMA_BASE_URL']} — dossier: {workdir}")
+    if not app_module.LANGCHAIN_AVAILABLE:
+        print("⚠️  LangChain non installé: les réponses et l'indexation prennent le chemin de repli")
+
+    stats = Stats()
+
+    def user(n):
+        time.sleep(args.ramp * n / max(1, args.users))
+        try:
+            VirtualUser(base_url, stats, n, args).run()
+        except Exception as e:
+            stats.record('parcours (exception)', 0, False)
+            print(f"❌ Utilisateur {n}: {e}")
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(args.users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    rows = stats.summary(elapsed)
+    print_report(rows, config, elapsed)
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({'config': config, 'elapsed': elapsed, 'steps': rows}, f, ensure_ascii=False, indent=2)
+        print(f"Rapport JSON: {json_path}")
+
+
+if __name__ == '__main__':
+    main()
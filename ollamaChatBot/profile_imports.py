@@ -0,0 +1,98 @@
+"""
+Rapport du temps de démarrage de l'application.
+
+Mesure, dans des process Python neufs:
+1. l'import de appchatbot (ce que paient un health check ou une requête d'auth),
+   avec le détail des modules les plus coûteux (python -X importtime);
+2. le chargement différé de la pile IA (langchain_modules()), payé une seule
+   fois en arrière-plan ou à la première requête IA.
+
+Usage:
+python profile_imports.py              # affiche le rapport
+python profile_imports.py -o import_profile.txt
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_python(code, importtime=False):
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ['-X', 'importtime']
+    cmd += ['-c', code]
+    return subprocess.run(cmd, cwd=HERE, capture_output=True, text=True)
+
+
+def parse_importtime(stderr):
+    """Lignes 'import time: self [us] | cumulative | package' -> [(cumul_us, self_us, package)]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            _, rest = line.split(':', 1)
+            self_us, cumulative_us, name = rest.split('|', 2)
+            rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+        except ValueError:
+            continue
+    return rows
+
+
+def timed(code):
+    res = run_python(
+        "import time; t0 = time.perf_counter()\n"
+        f"{code}\n"
+        "print(f'__ELAPSED__={time.perf_counter() - t0:.3f}')"
+    )
+    for line in res.stdout.splitlines():
+        if line.startswith('__ELAPSED__='):
+            return float(line.split('=', 1)[1]), None
+    return None, (res.stderr.strip().splitlines() or ['erreur inconnue'])[-1]
+
+
+def build_report(top):
+    lines = [f"Profil de démarrage — {datetime.now().isoformat(timespec='seconds')} — Python {sys.version.split()[0]}", ""]
+
+    app_s, err = timed('import appchatbot')
+    lines.append(f"Import de appchatbot          : {app_s:.3f}s" if app_s is not None else f"Import de appchatbot: échec ({err})")
+
+    ai_s, err = timed('import appchatbot\nt0 = time.perf_counter()\nappchatbot.langchain_modules()')
+    if ai_s is not None:
+        lines.append(f"Chargement différé pile IA    : {ai_s:.3f}s (langchain_modules, hors import de l'app)")
+    else:
+        lines.append(f"Chargement différé pile IA    : non mesuré ({err})")
+
+    rows = parse_importtime(run_python('import appchatbot', importtime=True).stderr)
+    if rows:
+        lines += ["", f"Top {top} des modules importés par appchatbot (temps cumulé):", ""]
+        lines.append(f"{'cumulé (ms)':>12} {'propre (ms)':>12}  module")
+        for cumulative_us, self_us, name in sorted(rows, reverse=True)[:top]:
+            lines.append(f"{cumulative_us / 1000:>12.1f} {self_us / 1000:>12.1f}  {name.strip()}")
+
+    heavy = [name.strip() for _, _, name in rows if name.strip().split('.')[0] in ('langchain', 'langchain_community', 'chromadb', 'pypdf')]
+    lines += ["", "Modules IA importés au démarrage: " + (', '.join(sorted(set(heavy))[:10]) if heavy else "aucun (chargement différé OK)")]
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', help='fichier de sortie du rapport')
+    parser.add_argument('--top', type=int, default=25)
+    args = parser.parse_args()
+
+    report = build_report(args.top)
+    print(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+        print(f"Rapport écrit dans {args.output}")
+
+
+if __name__ == '__main__':
+    main()
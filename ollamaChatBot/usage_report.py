@@ -0,0 +1,59 @@
+"""
+Rapport de consommation de tokens par utilisateur.
+
+Lit la table token_usage (tokens de prompt et de réponse comptés à chaque
+génération, résumés des messages trop longs compris) et affiche les plus gros
+consommateurs sur la période, avec le total par jour.
+
+Usage:
+python usage_report.py --days 7
+python usage_report.py --days 30 --top 20
+"""
+
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from appchatbot import app, db, User, TokenUsage, USER_DAILY_TOKEN_QUOTA
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=7, help='période couverte (jours, aujourd\'hui compris)')
+    parser.add_argument('--top', type=int, default=10, help='nombre d\'utilisateurs affichés')
+    args = parser.parse_args()
+
+    since = datetime.utcnow().date() - timedelta(days=args.days - 1)
+    total = TokenUsage.prompt_tokens + TokenUsage.completion_tokens
+
+    with app.app_context():
+        db.create_all()
+        users = db.session.query(
+            User.username,
+            func.sum(TokenUsage.requests),
+            func.sum(TokenUsage.prompt_tokens),
+            func.sum(TokenUsage.completion_tokens),
+            func.max(total),
+        ).join(User, User.id == TokenUsage.user_id).filter(
+            TokenUsage.day >= since
+        ).group_by(User.id).order_by(func.sum(total).desc()).limit(args.top).all()
+
+        days = db.session.query(
+            TokenUsage.day, func.sum(TokenUsage.requests), func.sum(total)
+        ).filter(TokenUsage.day >= since).group_by(TokenUsage.day).order_by(TokenUsage.day).all()
+
+    quota = f"{USER_DAILY_TOKEN_QUOTA} tokens/jour" if USER_DAILY_TOKEN_QUOTA else "aucun"
+    print(f"📊 Consommation depuis le {since.isoformat()} (quota: {quota})")
+    print()
+    print(f"{'utilisateur':<20} {'requêtes':>9} {'prompt':>10} {'réponse':>10} {'max/jour':>10}")
+    for username, requests, prompt_tokens, completion_tokens, max_day in users:
+        print(f"{username:<20} {requests:>9} {prompt_tokens:>10} {completion_tokens:>10} {max_day:>10}")
+    print()
+    print(f"{'jour':<12} {'requêtes':>9} {'tokens':>10}")
+    for day, requests, tokens in days:
+        print(f"{day.isoformat():<12} {requests:>9} {tokens:>10}")
+
+
+if __name__ == '__main__':
+    main()